@@ -1,243 +1,636 @@
 import asyncio
+import logging
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from aiogram.exceptions import TelegramRetryAfter
 
 from app import core
+from app.db import WALLETS_CHANNEL
 from app.polymarket import pm_get_positions, pm_get_value, pm_get_activity_trades
 
+logger = logging.getLogger(__name__)
 
-async def monitor_positions():
-    assert core.db_pool is not None
+# горячие запросы фоновых мониторов держим в константах: одинаковый текст —
+# попадание в LRU-кеш prepared statements asyncpg на соединении.
+# Запросы monitor_positions.
+SQL_SELECT_ACTIVE_WALLETS = """
+SELECT w.id, w.address, w.tg_user_id, w.label
+FROM wallets w
+WHERE w.is_whale=FALSE AND w.alerts_enabled=TRUE
+"""
+
+# Снапшоты equity всех кошельков пишем одним запросом за тик. Строку кошелька
+# вставляем, только если стоимость сдвинулась больше чем на $3 (доля)
+# или с прошлой записи прошло не меньше $4 секунд. Время ставит сам Postgres.
+# JOIN с wallets: удалённый за тик кошелёк не должен ронять всю пачку по FK.
+# Для каждой строки возвращаем, записана ли она, а для пропущенных —
+# последний снапшот из БД (стоимость и возраст в секундах), чтобы кэш
+# _last_equity совпадал с БД и пропущенный кошелёк не слался каждый тик.
+SQL_INSERT_EQUITY = """
+WITH t AS (
+    SELECT t.wallet_id, t.total_value, last.taken_at AS last_at, last.total_value AS last_value
+    FROM unnest($1::int[], $2::numeric[]) AS t(wallet_id, total_value)
+    JOIN wallets w ON w.id = t.wallet_id
+    LEFT JOIN LATERAL (
+        SELECT taken_at, total_value
+        FROM equity_snapshots
+        WHERE wallet_id=t.wallet_id
+        ORDER BY taken_at DESC
+        LIMIT 1
+    ) last ON TRUE
+), ins AS (
+    INSERT INTO equity_snapshots (wallet_id, taken_at, total_value)
+    SELECT wallet_id, now(), total_value
+    FROM t
+    WHERE last_at IS NULL
+       OR abs(total_value - last_value) / GREATEST(last_value, 1) >= $3
+       OR now() - last_at >= make_interval(secs => $4)
+    RETURNING wallet_id
+)
+SELECT t.wallet_id,
+       ins.wallet_id IS NOT NULL AS written,
+       t.last_value::float8 AS last_value,
+       extract(epoch FROM now() - t.last_at)::float8 AS last_age
+FROM t
+LEFT JOIN ins ON ins.wallet_id = t.wallet_id
+"""
+
+EQUITY_CHANGE_EPS = 0.001
+
+# последний записанный снапшот по кошельку: wallet_id -> (стоимость, monotonic-время).
+# Тот же критерий, что и в SQL_INSERT_EQUITY, но без похода в БД для
+# неизменившихся кошельков; SQL-проверка остаётся на случай рестарта.
+_last_equity: Dict[int, Tuple[float, float]] = {}
+
+
+def _equity_unchanged(wallet_id: int, value: float, now: float) -> bool:
     assert core.config is not None
+    prev = _last_equity.get(wallet_id)
+    if prev is None:
+        return False
+    prev_value, prev_at = prev
+    return (
+        abs(value - prev_value) / max(prev_value, 1) < EQUITY_CHANGE_EPS
+        and now - prev_at < core.config.equity_snapshot_interval_seconds
+    )
+
+# все позиции кошелька одним запросом: массивы колонок разворачиваем через unnest.
+# Порог алерта считается прямо в ON CONFLICT по старому last_percent_pnl;
+# last_alert_at = now() (время транзакции) отмечает строки, по которым надо
+# слать алерт — только они и возвращаются. Новая позиция алерта не даёт.
+SQL_UPSERT_POSITIONS = """
+WITH upserted AS (
+    INSERT INTO position_snapshots (
+        wallet_id, condition_id, title, outcome,
+        last_percent_pnl, last_cur_price, last_alert_at, updated_at
+    )
+    SELECT $1::int, t.condition_id, t.title, t.outcome, t.pct, t.price, NULL, now()
+    FROM unnest(
+        $2::text[], $3::text[], $4::text[], $5::float8[], $6::float8[]
+    ) AS t(condition_id, title, outcome, pct, price)
+    ON CONFLICT (wallet_id, condition_id)
+    DO UPDATE SET
+        title=EXCLUDED.title,
+        outcome=EXCLUDED.outcome,
+        last_percent_pnl=EXCLUDED.last_percent_pnl,
+        last_cur_price=EXCLUDED.last_cur_price,
+        last_alert_at=CASE
+            WHEN abs(EXCLUDED.last_percent_pnl - position_snapshots.last_percent_pnl) >= $7
+            THEN now()
+            ELSE position_snapshots.last_alert_at
+        END,
+        updated_at=now()
+    RETURNING title, outcome, last_percent_pnl, last_alert_at = now() AS alerted
+)
+SELECT title, outcome, last_percent_pnl FROM upserted WHERE alerted
+"""
+
+# запросы monitor_whales
+# один кит может отслеживаться несколькими пользователями: группируем по адресу,
+# чтобы тянуть сделки один раз, а подписчиков и их маркеры отдаём массивами
+SQL_SELECT_ACTIVE_WHALES = """
+SELECT w.address,
+       array_agg(w.id) AS ids,
+       array_agg(w.label) AS labels,
+       array_agg(w.tg_user_id) AS tg_ids,
+       array_agg(
+           COALESCE(
+               (SELECT am.last_seen_timestamp
+                FROM activity_markers am
+                WHERE am.wallet_id = w.id),
+               0
+           )
+       ) AS last_ts
+FROM wallets w
+WHERE w.is_whale=TRUE AND w.whale_alerts_enabled=TRUE
+GROUP BY w.address
+"""
+
+# во сколько раз максимум растягиваем интервал опроса китов в тишине
+WHALE_IDLE_MAX_MULTIPLIER = 4
+
+# JOIN с wallets: удалённый за тик кит не должен ронять по FK всю пачку,
+# иначе ни один маркер не сдвинется и сделки придут повторно
+SQL_UPSERT_MARKERS = """
+INSERT INTO activity_markers (wallet_id, last_seen_timestamp)
+SELECT t.wallet_id, t.last_seen_timestamp
+FROM unnest($1::int[], $2::bigint[]) AS t(wallet_id, last_seen_timestamp)
+JOIN wallets w ON w.id = t.wallet_id
+ON CONFLICT (wallet_id)
+DO UPDATE SET last_seen_timestamp=EXCLUDED.last_seen_timestamp
+"""
+
+
+# сигналы "изменились кошельки/киты": monitor_* просыпается, не дожидаясь интервала
+_wakeup: Dict[str, asyncio.Event] = {
+    "wallet": asyncio.Event(),
+    "whale": asyncio.Event(),
+}
+
+# снимок активных кошельков для monitor_positions: перечитываем только по
+# NOTIFY из триггера на wallets. MAX_AGE страхует на случай, если
+# LISTEN-соединение отвалилось и уведомление потерялось.
+# У китов снимка нет: их выборка тянет маркеры, которые меняются каждый тик.
+ACTIVE_WALLETS_MAX_AGE_SECONDS = 600
+_active_wallets: Optional[List[Any]] = None
+_active_wallets_at = 0.0
+# растёт на каждый NOTIFY по кошелькам: выборку, начатую до уведомления,
+# в снимок не кладём — она могла не увидеть закоммиченное изменение
+_active_wallets_gen = 0
+
+
+async def _get_active_wallets() -> List[Any]:
+    global _active_wallets, _active_wallets_at
+    now = time.monotonic()
+    if _active_wallets is not None and now - _active_wallets_at < ACTIVE_WALLETS_MAX_AGE_SECONDS:
+        return _active_wallets
+    gen = _active_wallets_gen
+    rows = await core.db_pool_bg.fetch(SQL_SELECT_ACTIVE_WALLETS)
+    if gen == _active_wallets_gen:
+        _active_wallets = rows
+        _active_wallets_at = now
+    return rows
+
+POSITION_ALERT_TEMPLATE = (
+    "⚠️ Движение по позиции\n\n"
+    "Кошелёк: <code>{address}</code>{label}\n"
+    "Рынок: <b>{title}</b>\n"
+    "Исход: <code>{outcome}</code>\n"
+    "Текущий PnL: {pct:+.2f}%\n"
+)
+
+# Telegram режет ботов на ~30 сообщений/сек, держим запас
+_send_sem = asyncio.Semaphore(20)
+SEND_MAX_ATTEMPTS = 3
+
+# алерты копим в очереди на юзера и шлём дайджестом: в одном сообщении
+# до ALERT_DIGEST_MAX_ITEMS алертов и не больше лимита Telegram по длине,
+# добор ждём не дольше ALERT_FLUSH_SECONDS. Воркер юзера, которому
+# ALERT_IDLE_SECONDS ничего не приходило, завершается.
+ALERT_FLUSH_SECONDS = 2.0
+ALERT_IDLE_SECONDS = 60.0
+ALERT_DIGEST_MAX_ITEMS = 8
+ALERT_DIGEST_MAX_CHARS = 4096
+ALERT_DIGEST_SEPARATOR = "\n\n---\n\n"
+# на остановке досылаем накопленное, но ждём не дольше этого (сек)
+ALERT_SHUTDOWN_TIMEOUT_SECONDS = 5.0
+_alert_queues: Dict[int, "asyncio.Queue[Optional[str]]"] = {}
+_alert_workers: Set["asyncio.Task[None]"] = set()
+
 
+def enqueue_alert(tg_id: int, text: str) -> None:
+    """Ставит алерт в очередь юзера, при необходимости поднимает её воркер."""
+    queue = _alert_queues.get(tg_id)
+    if queue is None:
+        queue = _alert_queues[tg_id] = asyncio.Queue()
+        task = asyncio.create_task(_drain_alerts(tg_id, queue))
+        _alert_workers.add(task)
+        task.add_done_callback(_alert_workers.discard)
+    queue.put_nowait(text)
+
+
+async def _drain_alerts(tg_id: int, queue: "asyncio.Queue[Optional[str]]") -> None:
+    # None в очереди — сигнал shutdown_alerts: отправить собранное и выйти
+    loop = asyncio.get_running_loop()
+    pending: Optional[str] = None
+    closing = False
     while True:
-        try:
-            async with core.db_pool.acquire() as conn:
-                wallets = await conn.fetch(
-                    """
-                    SELECT w.id, w.address, w.tg_user_id, w.label
-                    FROM wallets w
-                    WHERE w.is_whale=FALSE AND w.alerts_enabled=TRUE
-                    """
+        if pending is None:
+            if closing:
+                if queue.empty():
+                    del _alert_queues[tg_id]
+                    return
+                pending = queue.get_nowait()
+                continue
+            try:
+                pending = await asyncio.wait_for(queue.get(), timeout=ALERT_IDLE_SECONDS)
+            except asyncio.TimeoutError:
+                if queue.empty():
+                    # между проверкой и удалением нет await — алерт не потеряется
+                    del _alert_queues[tg_id]
+                    return
+                continue
+            if pending is None:
+                closing = True
+                continue
+
+        batch = [pending]
+        size = len(pending)
+        pending = None
+        deadline = loop.time() + ALERT_FLUSH_SECONDS
+        while len(batch) < ALERT_DIGEST_MAX_ITEMS:
+            if closing:
+                # на остановке добор не ждём: забираем только уже лежащее в очереди
+                if queue.empty():
+                    break
+                text = queue.get_nowait()
+            else:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    text = await asyncio.wait_for(queue.get(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    break
+            if text is None:
+                closing = True
+                continue
+            size += len(ALERT_DIGEST_SEPARATOR) + len(text)
+            if size > ALERT_DIGEST_MAX_CHARS:
+                # не влезает — уйдёт первым в следующем сообщении
+                pending = text
+                break
+            batch.append(text)
+
+        await _send_alert(tg_id, ALERT_DIGEST_SEPARATOR.join(batch))
+
+
+async def shutdown_alerts() -> None:
+    """
+    Досылает алерты из очередей и останавливает воркеры.
+    Вызывать после остановки мониторов и до закрытия сессии бота;
+    что не успело уйти за ALERT_SHUTDOWN_TIMEOUT_SECONDS, отменяется.
+    """
+    for queue in _alert_queues.values():
+        queue.put_nowait(None)
+    workers = set(_alert_workers)
+    if not workers:
+        return
+    _, stuck = await asyncio.wait(workers, timeout=ALERT_SHUTDOWN_TIMEOUT_SECONDS)
+    for task in stuck:
+        task.cancel()
+    if stuck:
+        logger.warning("dropped alerts for %d users on shutdown", len(stuck))
+        await asyncio.gather(*stuck, return_exceptions=True)
+
+
+async def _send_alert(tg_id: int, text: str) -> None:
+    """
+    Отправка алерта: не больше 20 параллельных запросов, на 429 ждём
+    retry_after и пробуем снова, прочие ошибки глотаем.
+    """
+    assert core.bot is not None
+    for _ in range(SEND_MAX_ATTEMPTS):
+        async with _send_sem:
+            try:
+                await core.bot.send_message(  # type: ignore[arg-type]
+                    tg_id,
+                    text,
+                    parse_mode="HTML",
+                    disable_web_page_preview=True,
                 )
+                return
+            except TelegramRetryAfter as e:
+                delay = e.retry_after
+            except Exception:
+                return
+        await asyncio.sleep(delay)
 
-            for w in wallets:
-                address = w["address"]
-                wallet_id = w["id"]
-                tg_id = w["tg_user_id"]
-                label = w["label"]
 
-                try:
-                    positions = await pm_get_positions(address)
-                except Exception:
-                    continue
+async def _process_wallet(w) -> Optional[Tuple[int, float]]:
+    """
+    Снимает позиции одного кошелька, пишет снапшоты позиций и шлёт алерты.
+    Возвращает (wallet_id, стоимость) для пакетной записи equity
+    или None, если писать нечего.
+    """
+    assert core.db_pool_bg is not None
+    assert core.config is not None
 
-                try:
-                    total_value = await pm_get_value(address)
-                except Exception:
-                    total_value = None
-
-                if total_value is not None:
-                    async with core.db_pool.acquire() as conn:
-                        await conn.execute(
-                            """
-                            INSERT INTO equity_snapshots (wallet_id, taken_at, total_value)
-                            VALUES ($1, $2, $3)
-                            """,
-                            wallet_id,
-                            core.now_utc(),
-                            total_value,
-                        )
-
-                async with core.db_pool.acquire() as conn:
-                    for p in positions:
-                        cond_id = p.get("conditionId")
-                        title = p.get("title")
-                        outcome = p.get("outcome")
-                        cur_pct = p.get("percentPnl")
-                        cur_price = p.get("curPrice")
-
-                        if cond_id is None or cur_pct is None:
-                            continue
-
-                        row = await conn.fetchrow(
-                            """
-                            SELECT last_percent_pnl
-                            FROM position_snapshots
-                            WHERE wallet_id=$1 AND condition_id=$2
-                            """,
-                            wallet_id,
-                            cond_id,
-                        )
-                        should_alert = False
-                        if row is None:
-                            should_alert = False
-                        else:
-                            prev_pct = row["last_percent_pnl"]
-                            if prev_pct is not None:
-                                delta = float(cur_pct) - float(prev_pct)
-                                if abs(delta) >= core.config.alert_threshold_percent:
-                                    should_alert = True
-
-                        await conn.execute(
-                            """
-                            INSERT INTO position_snapshots (
-                                wallet_id, condition_id, title, outcome,
-                                last_percent_pnl, last_cur_price, last_alert_at, updated_at
-                            )
-                            VALUES ($1, $2, $3, $4, $5, $6,
-                                    CASE WHEN $7 THEN now() ELSE last_alert_at END,
-                                    now())
-                            ON CONFLICT (wallet_id, condition_id)
-                            DO UPDATE SET
-                                title=EXCLUDED.title,
-                                outcome=EXCLUDED.outcome,
-                                last_percent_pnl=EXCLUDED.last_percent_pnl,
-                                last_cur_price=EXCLUDED.last_cur_price,
-                                last_alert_at=CASE
-                                    WHEN $7 THEN now()
-                                    ELSE position_snapshots.last_alert_at
-                                END,
-                                updated_at=now()
-                            """,
-                            wallet_id,
-                            cond_id,
-                            title,
-                            outcome,
-                            float(cur_pct),
-                            float(cur_price) if cur_price is not None else None,
-                            should_alert,
-                        )
-
-                        if should_alert and core.bot is not None:
-                            label_text = f" ({label})" if label else ""
-                            sign = "+" if float(cur_pct) >= 0 else ""
-                            text = (
-                                "⚠️ Движение по позиции\n\n"
-                                f"Кошелёк: <code>{address}</code>{label_text}\n"
-                                f"Рынок: <b>{title}</b>\n"
-                                f"Исход: <code>{outcome}</code>\n"
-                                f"Текущий PnL: {sign}{float(cur_pct):.2f}%\n"
-                            )
-                            try:
-                                await core.bot.send_message(  # type: ignore[arg-type]
-                                    tg_id,
-                                    text,
-                                    parse_mode="HTML",
-                                )
-                            except Exception:
-                                pass
+    address = w["address"]
+    wallet_id = w["id"]
+    tg_id = w["tg_user_id"]
+    label = w["label"]
+
+    # два независимых запроса к Polymarket — параллельно
+    positions, total_value = await asyncio.gather(
+        pm_get_positions(address),
+        pm_get_value(address),
+        return_exceptions=True,
+    )
+    if isinstance(positions, Exception):
+        # без позиций опрашивать нечего: пусть _gather_bounded учтёт ошибку
+        raise positions
+    if isinstance(total_value, Exception):
+        total_value = None
+
+    equity = None
+    if total_value is not None and not _equity_unchanged(wallet_id, total_value, time.monotonic()):
+        equity = (wallet_id, total_value)
+
+    # одна позиция на condition_id (как и в UNIQUE-ключе таблицы)
+    fresh: Dict[str, Dict[str, Any]] = {}
+    for p in positions:
+        if p.get("conditionId") is None or p.get("percentPnl") is None:
+            continue
+        fresh[p["conditionId"]] = p
+
+    alerts = []
+    if fresh:
+        ps = fresh.values()
+        alerts = await core.db_pool_bg.fetch(
+            SQL_UPSERT_POSITIONS,
+            wallet_id,
+            list(fresh),
+            [p.get("title") for p in ps],
+            [p.get("outcome") for p in ps],
+            [p["percentPnl"] for p in ps],
+            [p.get("curPrice") for p in ps],
+            core.config.alert_threshold_percent,
+        )
+
+    # алерты ставим в очередь уже после записи в БД, соединение к этому моменту отпущено
+    if core.bot is not None and alerts:
+        label_text = f" ({label})" if label else ""
+        for title, outcome, cur_pct in alerts:
+            enqueue_alert(
+                tg_id,
+                POSITION_ALERT_TEMPLATE.format_map(
+                    {
+                        "address": address,
+                        "label": label_text,
+                        "title": title,
+                        "outcome": outcome,
+                        "pct": cur_pct,
+                    }
+                ),
+            )
+
+    return equity
 
+
+async def _write_equity(rows: List[Tuple[int, float]]) -> None:
+    """Пишет снапшоты equity за тик одним запросом и обновляет _last_equity."""
+    ids, values = zip(*rows)
+    written = await core.db_pool_bg.fetch(
+        SQL_INSERT_EQUITY,
+        ids,
+        values,
+        EQUITY_CHANGE_EPS,
+        core.config.equity_snapshot_interval_seconds,
+    )
+    now = time.monotonic()
+    value_by_id = dict(rows)
+    for r in written:
+        wallet_id = r["wallet_id"]
+        if r["written"]:
+            _last_equity[wallet_id] = (value_by_id[wallet_id], now)
+        else:
+            # БД пропустила строку по тому же правилу — запоминаем её снапшот,
+            # чтобы до конца интервала не слать этот кошелёк снова
+            _last_equity[wallet_id] = (r["last_value"], now - r["last_age"])
+
+
+# кошелёк, который падает тик за тиком (битый адрес, 4xx от API), не должен
+# дёргать Polymarket и лог каждый тик: после n ошибок подряд пропускаем его
+# ITEM_BACKOFF_BASE_SECONDS * 2**(n-1) секунд (не больше BACKOFF_MAX_SECONDS).
+# (kind, address) -> (ошибок подряд, monotonic-время следующей попытки)
+ITEM_BACKOFF_BASE_SECONDS = 30
+_item_failures: Dict[Tuple[str, str], Tuple[int, float]] = {}
+
+
+async def _gather_bounded(items, worker, kind: str) -> List[Any]:
+    """
+    Опрашивает items параллельно, но не больше max_concurrency разом,
+    чтобы не выбрать весь пул соединений БД и не упереться в лимиты API.
+    Ошибка одного item не мешает остальным; item с ошибками подряд
+    временно пропускается.
+    Возвращает результаты worker по порядку items (None для упавших и пропущенных).
+    """
+    sem = asyncio.Semaphore(core.config.max_concurrency)
+    now = time.monotonic()
+
+    # кошельки, удалённые или выключенные, пока падали, из выборки пропадают —
+    # их счётчики ошибок больше не нужны
+    current = {item["address"] for item in items}
+    for key in [k for k in _item_failures if k[0] == kind and k[1] not in current]:
+        del _item_failures[key]
+
+    async def handle(item):
+        key = (kind, item["address"])
+        failed = _item_failures.get(key)
+        if failed is not None and now < failed[1]:
+            return None
+        async with sem:
+            try:
+                result = await worker(item)
+            except Exception:
+                n = failed[0] + 1 if failed is not None else 1
+                delay = min(ITEM_BACKOFF_BASE_SECONDS * 2 ** (n - 1), core.BACKOFF_MAX_SECONDS)
+                _item_failures[key] = (n, time.monotonic() + delay)
+                logger.exception("%s %s poll failed (%d in a row)", kind, item["address"], n)
+                return None
+        if failed is not None:
+            del _item_failures[key]
+        return result
+
+    return await asyncio.gather(*(handle(item) for item in items))
+
+
+async def monitor_positions():
+    assert core.db_pool_bg is not None
+    assert core.config is not None
+
+    failures = 0
+    while True:
+        _wakeup["wallet"].clear()
+        try:
+            wallets = await _get_active_wallets()
+            # кэш equity держим только для опрашиваемых кошельков
+            active = {w["id"] for w in wallets}
+            for wallet_id in [k for k in _last_equity if k not in active]:
+                del _last_equity[wallet_id]
+
+            results = await _gather_bounded(wallets, _process_wallet, "wallet")
+            equity = [r for r in results if r is not None]
+            if equity:
+                await _write_equity(equity)
+            failures = 0
         except Exception:
-            pass
+            failures += 1
+            logger.exception("monitor_positions iteration failed (%d in a row)", failures)
+
+        await core.backoff_sleep(
+            core.config.poll_interval_seconds, failures, _wakeup["wallet"]
+        )
+
+
+def _whale_trade_body(t: Dict[str, Any]) -> str:
+    """Часть алерта о сделке кита без заголовка и адреса."""
+    text = (
+        f"Рынок: <b>{t.get('title')}</b>\n"
+        f"Сторона: <b>{t.get('side')}</b> по исходу <code>{t.get('outcome')}</code>"
+    )
+    usdc_size = t.get("usdcSize")
+    if usdc_size is not None:
+        text += f"\nОбъём: <b>{usdc_size:.2f} USDC</b>"
+    price = t.get("price")
+    if price is not None:
+        text += f"\nЦена: {price:.3f}"
+    slug = t.get("slug")
+    event_slug = t.get("eventSlug")
+    if slug and event_slug:
+        url = f"https://polymarket.com/event/{event_slug}/{slug}"
+        text += f'\n\n<a href="{url}">Открыть рынок</a>'
+    return text
 
-        await asyncio.sleep(core.config.poll_interval_seconds)
+
+async def _process_whale(r) -> List[Tuple[int, int]]:
+    """
+    Тянет сделки одного адреса кита и шлёт алерты каждому его подписчику.
+    Возвращает [(wallet_id, max_ts)] для сдвига маркеров подписчиков с новыми сделками.
+    """
+    address = r["address"]
+    since_ts = min(r["last_ts"])
+
+    trades = await pm_get_activity_trades(address, since_ts=since_ts)
+    if not trades:
+        return []
+
+    # API отдаёт сделки от новых к старым (sortDirection=DESC): идём до первой
+    # уже виденной всеми подписчиками и разворачиваем, чтобы алерты шли
+    # в хронологическом порядке
+    fresh = []
+    for t in trades:
+        ts = t.get("timestamp") or 0
+        if ts <= since_ts:
+            break
+        fresh.append((ts, t))
+    if not fresh:
+        return []
+    fresh.reverse()
+
+    # тело алерта зависит только от сделки: собираем его один раз на сделку,
+    # подписчику остаётся подставить свою подпись кошелька
+    bodies = [(ts, _whale_trade_body(t)) for ts, t in fresh]
+
+    moved = []
+    for wallet_id, label, tg_id, last_ts in zip(r["ids"], r["labels"], r["tg_ids"], r["last_ts"]):
+        # у каждого подписчика свой маркер: шлём только то, чего он ещё не видел
+        news = [(ts, body) for ts, body in bodies if ts > last_ts]
+        if not news:
+            continue
+        moved.append((wallet_id, news[-1][0]))
+        if core.bot is None:
+            continue
+
+        label_text = f" ({label})" if label else ""
+        head = f"🐳 Новая сделка кита\nКошелёк: <code>{address}</code>{label_text}\n"
+        for _, body in news:
+            enqueue_alert(tg_id, head + body)
+
+    return moved
 
 
 async def monitor_whales():
-    assert core.db_pool is not None
+    assert core.db_pool_bg is not None
     assert core.config is not None
 
+    failures = 0
+    idle_mult = 1
     while True:
+        _wakeup["whale"].clear()
         try:
-            async with core.db_pool.acquire() as conn:
-                rows = await conn.fetch(
-                    """
-                    SELECT w.id, w.address, w.label, w.tg_user_id,
-                           COALESCE(am.last_seen_timestamp, 0) as last_ts,
-                           am.id as marker_id
-                    FROM wallets w
-                    LEFT JOIN activity_markers am ON am.wallet_id = w.id
-                    WHERE w.is_whale=TRUE AND w.whale_alerts_enabled=TRUE
-                    """
+            rows = await core.db_pool_bg.fetch(SQL_SELECT_ACTIVE_WHALES)
+
+            results = await _gather_bounded(rows, _process_whale, "whale")
+
+            # маркеры всех китов с новыми сделками сдвигаем одним запросом
+            moved = [m for res in results if res for m in res]
+            if moved:
+                await core.db_pool_bg.execute(
+                    SQL_UPSERT_MARKERS,
+                    [wallet_id for wallet_id, _ in moved],
+                    [max_ts for _, max_ts in moved],
                 )
+                idle_mult = 1
+            elif any(res is not None for res in results):
+                # тишина — только если хоть один кит реально опрошен ([] — успех
+                # без сделок); при сплошных ошибках API интервал не растягиваем
+                idle_mult = min(idle_mult * 2, WHALE_IDLE_MAX_MULTIPLIER)
+            failures = 0
+        except Exception:
+            failures += 1
+            logger.exception("monitor_whales iteration failed (%d in a row)", failures)
 
-            for r in rows:
-                wallet_id = r["id"]
-                address = r["address"]
-                label = r["label"]
-                tg_id = r["tg_user_id"]
-                last_ts = int(r["last_ts"] or 0)
-                marker_id = r["marker_id"]
+        # пока ни у одного кита нет новых сделок, опрашиваем всё реже
+        # (x2 за тик, до WHALE_IDLE_MAX_MULTIPLIER); первая же сделка
+        # или новый кит возвращают обычный интервал
+        await core.backoff_sleep(
+            core.config.whale_poll_interval_seconds * idle_mult, failures, _wakeup["whale"]
+        )
+        if _wakeup["whale"].is_set():
+            idle_mult = 1
+
+
+def _on_wallets_changed(conn, pid, channel, payload) -> None:
+    global _active_wallets, _active_wallets_gen
+    if payload == "wallet":
+        _active_wallets = None
+        _active_wallets_gen += 1
+    event = _wakeup.get(payload)
+    if event is not None:
+        event.set()
 
-                try:
-                    trades = await pm_get_activity_trades(address, since_ts=last_ts)
-                except Exception:
-                    continue
-
-                if not trades:
-                    continue
-
-                trades_sorted = sorted(trades, key=lambda t: int(t.get("timestamp", 0)))
-                max_ts = last_ts
-
-                for t in trades_sorted:
-                    ts = int(t.get("timestamp", 0))
-                    if ts <= last_ts:
-                        continue
-                    max_ts = max(max_ts, ts)
-
-                    title = t.get("title")
-                    outcome = t.get("outcome")
-                    side = t.get("side")
-                    usdc_size = t.get("usdcSize")
-                    price = t.get("price")
-                    slug = t.get("slug")
-                    event_slug = t.get("eventSlug")
-
-                    label_text = f" ({label})" if label else ""
-                    url = (
-                        f"https://polymarket.com/event/{event_slug}/{slug}"
-                        if slug and event_slug
-                        else ""
-                    )
-
-                    text_lines = [
-                        "🐳 Новая сделка кита",
-                        f"Кошелёк: <code>{address}</code>{label_text}",
-                        f"Рынок: <b>{title}</b>",
-                        f"Сторона: <b>{side}</b> по исходу <code>{outcome}</code>",
-                    ]
-                    if usdc_size is not None:
-                        try:
-                            usdc_f = float(usdc_size)
-                            text_lines.append(f"Объём: <b>{usdc_f:.2f} USDC</b>")
-                        except Exception:
-                            pass
-                    if price is not None:
-                        try:
-                            price_f = float(price)
-                            text_lines.append(f"Цена: {price_f:.3f}")
-                        except Exception:
-                            pass
-                    if url:
-                        text_lines.append(f"\n<a href=\"{url}\">Открыть рынок</a>")
-
-                    if core.bot is not None:
-                        try:
-                            await core.bot.send_message(  # type: ignore[arg-type]
-                                tg_id,
-                                "\n".join(text_lines),
-                                parse_mode="HTML",
-                                disable_web_page_preview=True,
-                            )
-                        except Exception:
-                            pass
-
-                if max_ts > last_ts:
-                    async with core.db_pool.acquire() as conn:
-                        if marker_id:
-                            await conn.execute(
-                                "UPDATE activity_markers SET last_seen_timestamp=$1 WHERE id=$2",
-                                max_ts,
-                                marker_id,
-                            )
-                        else:
-                            await conn.execute(
-                                "INSERT INTO activity_markers (wallet_id, last_seen_timestamp) VALUES ($1, $2)",
-                                wallet_id,
-                                max_ts,
-                            )
 
+async def listen_wallet_changes():
+    """
+    Держит одно соединение пула с LISTEN wallets_changed: добавленный кошелёк
+    опрашивается сразу, а не через poll_interval_seconds, а снимок
+    активных кошельков перечитывается только после изменений.
+    Если соединение оборвалось, переподключаемся.
+    """
+    assert core.db_pool_bg is not None
+
+    failures = 0
+    while True:
+        try:
+            async with core.db_pool_bg.acquire() as conn:
+                lost = asyncio.get_running_loop().create_future()
+
+                def on_terminated(_conn) -> None:
+                    if not lost.done():
+                        lost.set_result(None)
+
+                conn.add_termination_listener(on_terminated)
+                await conn.add_listener(WALLETS_CHANNEL, _on_wallets_changed)
+                # пока LISTEN не было, уведомления могли пройти мимо:
+                # сбрасываем снимок и будим оба монитора
+                for payload in _wakeup:
+                    _on_wallets_changed(conn, 0, WALLETS_CHANNEL, payload)
+                failures = 0
+                try:
+                    # уведомления приходят в колбэк, здесь ждём обрыва соединения
+                    await lost
+                finally:
+                    # оборванное соединение пул уже отцепил — снимать нечего;
+                    # при отмене задачи lost отменяется вместе с ней
+                    if lost.cancelled() or not lost.done():
+                        conn.remove_termination_listener(on_terminated)
+                        await conn.remove_listener(WALLETS_CHANNEL, _on_wallets_changed)
+            logger.warning("LISTEN %s connection lost, reconnecting", WALLETS_CHANNEL)
         except Exception:
-            pass
+            failures += 1
+            logger.exception("LISTEN %s failed (%d in a row)", WALLETS_CHANNEL, failures)
 
-        await asyncio.sleep(core.config.whale_poll_interval_seconds)
+        await core.backoff_sleep(1, failures)
@@ -9,6 +9,11 @@ class Config:
     alert_threshold_percent: float = 5.0
     poll_interval_seconds: int = 60
     whale_poll_interval_seconds: int = 60
+    max_concurrency: int = 8
+    equity_snapshot_interval_seconds: int = 600
+    db_pool_min_size: int = 2
+    db_pool_max_size: int = 20
+    db_pool_max_idle_seconds: float = 300.0
 
     @classmethod
     def from_env(cls) -> "Config":
@@ -22,10 +27,20 @@ class Config:
         alert = float(os.getenv("ALERT_THRESHOLD_PERCENT", "5.0"))
         poll = int(os.getenv("POLL_INTERVAL_SECONDS", "60"))
         whale_poll = int(os.getenv("WHALE_POLL_INTERVAL_SECONDS", "60"))
+        max_concurrency = int(os.getenv("MAX_CONCURRENCY", "8"))
+        equity_interval = int(os.getenv("EQUITY_SNAPSHOT_INTERVAL_SECONDS", "600"))
+        db_pool_min = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+        db_pool_max = int(os.getenv("DB_POOL_MAX_SIZE", "20"))
+        db_pool_idle = float(os.getenv("DB_POOL_MAX_IDLE_SECONDS", "300"))
         return cls(
             bot_token=token,
             database_url=db_url,
             alert_threshold_percent=alert,
             poll_interval_seconds=poll,
             whale_poll_interval_seconds=whale_poll,
+            max_concurrency=max_concurrency,
+            equity_snapshot_interval_seconds=equity_interval,
+            db_pool_min_size=db_pool_min,
+            db_pool_max_size=db_pool_max,
+            db_pool_max_idle_seconds=db_pool_idle,
         )
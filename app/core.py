@@ -1,10 +1,13 @@
-from typing import Optional
-from datetime import datetime, timezone
+import asyncio
+import random
+import time
+from typing import Any, Dict, Mapping, Optional
 
 import asyncpg
 import httpx
 from aiogram import Dispatcher
-from dataclasses import dataclass
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
 
 from .config import Config
 
@@ -12,15 +15,95 @@ from .config import Config
 # глобальное состояние, к которому обращаются другие модули
 config: Optional[Config] = None
 bot: Optional["Bot"] = None  # тип Bot импортируется в main.py при создании
-db_pool: Optional[asyncpg.Pool] = None
+db_pool: Optional[asyncpg.Pool] = None  # хэндлеры апдейтов
+db_pool_bg: Optional[asyncpg.Pool] = None  # фоновые мониторы, чтобы не отнимали соединения у UI
 http_client: Optional[httpx.AsyncClient] = None
 
+# состояние FSM (режим добавления кошелька/кита) живёт не дольше этого (сек)
+FSM_STATE_TTL_SECONDS = 600
+
+
+class ExpiringMemoryStorage(MemoryStorage):
+    """
+    MemoryStorage с ограниченной памятью: состояние живёт ttl секунд с момента
+    установки, пустые записи удаляются. Стандартный MemoryStorage заводит запись
+    на каждого написавшего юзера и не удаляет её никогда.
+    """
+
+    def __init__(self, ttl: float) -> None:
+        super().__init__()
+        self.ttl = ttl
+        # key -> monotonic-время установки; порядок вставки = порядок установки
+        self._set_at: Dict[StorageKey, float] = {}
+
+    async def set_state(self, key: StorageKey, state: Any = None) -> None:
+        await super().set_state(key, state)
+        self._set_at.pop(key, None)
+        if self.storage[key].state is not None:
+            self._set_at[key] = time.monotonic()
+        self._drop_if_empty(key)
+        self._expire()
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        self._expire()
+        record = self.storage.get(key)
+        return record.state if record is not None else None
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        await super().set_data(key, data)
+        self._drop_if_empty(key)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        record = self.storage.get(key)
+        return record.data.copy() if record is not None else {}
+
+    async def get_value(self, storage_key: StorageKey, dict_key: str, default: Any = None) -> Any:
+        return (await self.get_data(storage_key)).get(dict_key, default)
+
+    def _drop_if_empty(self, key: StorageKey) -> None:
+        record = self.storage.get(key)
+        if record is not None and record.state is None and not record.data:
+            del self.storage[key]
+
+    def _expire(self) -> None:
+        now = time.monotonic()
+        while self._set_at:
+            key, set_at = next(iter(self._set_at.items()))
+            if now - set_at < self.ttl:
+                break
+            del self._set_at[key]
+            self.storage.pop(key, None)
+
+
 # основной Dispatcher для aiogram
-dp: Dispatcher = Dispatcher()
+dp: Dispatcher = Dispatcher(storage=ExpiringMemoryStorage(ttl=FSM_STATE_TTL_SECONDS))
 
 # язык по умолчанию
 LANG_DEFAULT = "en"
 
+# потолок паузы фоновых циклов при затяжных ошибках (сек)
+BACKOFF_MAX_SECONDS = 600
+
 
-def now_utc() -> datetime:
-    return datetime.now(timezone.utc)
+async def backoff_sleep(
+    interval: float,
+    failures: int,
+    wakeup: Optional[asyncio.Event] = None,
+) -> None:
+    """
+    Пауза между итерациями фонового цикла.
+    Без ошибок спим обычный interval (или до сигнала wakeup, если он передан),
+    после failures ошибок подряд — экспоненциальный backoff с полным джиттером
+    (AWS "Full Jitter").
+    """
+    if failures <= 0:
+        if wakeup is None:
+            await asyncio.sleep(interval)
+            return
+        try:
+            await asyncio.wait_for(wakeup.wait(), timeout=interval)
+        except asyncio.TimeoutError:
+            pass
+        return
+    cap = min(interval * 2 ** failures, BACKOFF_MAX_SECONDS)
+    await asyncio.sleep(random.uniform(0, cap))
@@ -1,9 +1,57 @@
-from typing import Optional
+import time
+from typing import Dict, List, Optional, Set, Tuple
 
 import asyncpg
 
 from .core import LANG_DEFAULT
 
+# размер LRU-кеша prepared statements asyncpg на одно соединение
+STATEMENT_CACHE_SIZE = 256
+
+# язык пользователя почти не меняется: держим его в памяти, чтобы не ходить в БД
+# на каждый апдейт. user_id -> (lang, monotonic-время записи).
+# Размер ограничен: при переполнении выкидываем самую давнюю запись.
+LANG_CACHE_TTL_SECONDS = 300
+LANG_CACHE_MAX_SIZE = 10_000
+_lang_cache: Dict[int, Tuple[str, float]] = {}
+
+
+def _cache_lang(user_id: int, lang: str) -> None:
+    # перевставка переносит ключ в конец: порядок dict = порядок свежести
+    _lang_cache.pop(user_id, None)
+    if len(_lang_cache) >= LANG_CACHE_MAX_SIZE:
+        _lang_cache.pop(next(iter(_lang_cache)))
+    _lang_cache[user_id] = (lang, time.monotonic())
+
+
+# пользователи, чья строка в tg_users уже точно есть: для них upsert на каждое
+# сообщение не нужен. Строки не удаляются, так что инвалидация не требуется;
+# при переполнении просто сбрасываем множество — upsert идемпотентен
+KNOWN_USERS_MAX_SIZE = 100_000
+_known_users: Set[int] = set()
+
+
+def _mark_known(user_id: int) -> None:
+    if len(_known_users) >= KNOWN_USERS_MAX_SIZE:
+        _known_users.clear()
+    _known_users.add(user_id)
+
+
+# список кошельков пользователя для экрана состояния: листание ◀/▶ не должно
+# ходить в БД на каждый клик. tg_user_id -> (строки, monotonic-время записи).
+# Сбрасывается в save_wallet, TTL страхует от прочих изменений
+WALLETS_CACHE_TTL_SECONDS = 60
+WALLETS_CACHE_MAX_SIZE = 10_000
+_wallets_cache: Dict[int, Tuple[List[asyncpg.Record], float]] = {}
+
+SELECT_USER_WALLET_LIST = """
+SELECT id, address, label, is_whale
+FROM wallets
+WHERE tg_user_id=$1
+ORDER BY is_whale, created_at, id
+"""
+
+
 CREATE_TABLES_SQL = """
 CREATE TABLE IF NOT EXISTS tg_users (
     id BIGINT PRIMARY KEY,
@@ -22,6 +70,18 @@ CREATE TABLE IF NOT EXISTS wallets (
     created_at TIMESTAMPTZ DEFAULT now()
 );
 
+-- один и тот же адрес у пользователя — максимум по разу как кошелёк и как кит;
+-- индекс даёт save_wallet атомарный INSERT ... ON CONFLICT DO NOTHING
+DELETE FROM wallets a
+USING wallets b
+WHERE a.tg_user_id = b.tg_user_id
+  AND a.address = b.address
+  AND a.is_whale = b.is_whale
+  AND a.id > b.id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS wallets_user_address_kind_uniq
+    ON wallets (tg_user_id, address, is_whale);
+
 CREATE TABLE IF NOT EXISTS position_snapshots (
     id SERIAL PRIMARY KEY,
     wallet_id INTEGER REFERENCES wallets(id) ON DELETE CASCADE,
@@ -41,42 +101,141 @@ CREATE TABLE IF NOT EXISTS activity_markers (
     last_seen_timestamp BIGINT
 );
 
+-- один маркер на кошелёк: чистим возможные дубли и вешаем уникальный индекс,
+-- чтобы monitor_whales мог делать INSERT ... ON CONFLICT (wallet_id)
+DELETE FROM activity_markers a
+USING activity_markers b
+WHERE a.wallet_id = b.wallet_id AND a.id < b.id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS activity_markers_wallet_uniq
+    ON activity_markers (wallet_id);
+
 CREATE TABLE IF NOT EXISTS equity_snapshots (
     id SERIAL PRIMARY KEY,
     wallet_id INTEGER REFERENCES wallets(id) ON DELETE CASCADE,
     taken_at TIMESTAMPTZ NOT NULL,
     total_value NUMERIC NOT NULL
 );
+
+-- частичные индексы под выборки фоновых мониторов
+CREATE INDEX IF NOT EXISTS idx_wallets_active_user
+    ON wallets (id) WHERE is_whale=FALSE AND alerts_enabled=TRUE;
+
+CREATE INDEX IF NOT EXISTS idx_wallets_active_whale
+    ON wallets (id) WHERE is_whale=TRUE AND whale_alerts_enabled=TRUE;
+
+-- последний снапшот кошелька читается index-only scan: total_value лежит в индексе
+CREATE INDEX IF NOT EXISTS idx_equity_snapshots_wallet_cov
+    ON equity_snapshots (wallet_id, taken_at DESC) INCLUDE (total_value);
+DROP INDEX IF EXISTS idx_equity_snapshots_wallet;
+
+-- список кошельков юзера (/wallets) в порядке добавления без сортировки
+CREATE INDEX IF NOT EXISTS idx_wallets_user_created
+    ON wallets (tg_user_id, created_at);
+
+-- постраничный экран /state: свои кошельки, потом киты, по времени добавления
+CREATE INDEX IF NOT EXISTS idx_wallets_user_kind
+    ON wallets (tg_user_id, is_whale, created_at, id);
+
+-- любое изменение кошелька/кита будит соответствующий монитор через
+-- LISTEN wallets_changed и сбрасывает его снимок списка кошельков
+CREATE OR REPLACE FUNCTION notify_wallets_changed() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify(
+        'wallets_changed',
+        CASE WHEN (CASE WHEN TG_OP = 'DELETE' THEN OLD.is_whale ELSE NEW.is_whale END)
+             THEN 'whale' ELSE 'wallet' END
+    );
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS wallets_changed ON wallets;
+CREATE TRIGGER wallets_changed
+    AFTER INSERT OR UPDATE OR DELETE ON wallets
+    FOR EACH ROW EXECUTE FUNCTION notify_wallets_changed();
+"""
+
+# канал NOTIFY из триггера wallets_changed; payload — "wallet" или "whale"
+WALLETS_CHANNEL = "wallets_changed"
+
+
+# добавление кошелька/кита за один round-trip: вставка кошелька, маркер
+# активности для кита и классификация результата в одном запросе
+SAVE_WALLET_SQL = """
+WITH ins AS (
+    INSERT INTO wallets (tg_user_id, address, label, is_whale, alerts_enabled, whale_alerts_enabled)
+    VALUES ($1, $2, $3, $4, NOT $4, $4)
+    ON CONFLICT (tg_user_id, address, is_whale) DO NOTHING
+    RETURNING id, is_whale
+), marker AS (
+    INSERT INTO activity_markers (wallet_id, last_seen_timestamp)
+    SELECT id, 0 FROM ins WHERE is_whale
+)
+SELECT CASE
+    WHEN NOT EXISTS (SELECT 1 FROM ins) THEN 'exists'
+    WHEN $4 THEN 'whale_added'
+    ELSE 'wallet_added'
+END
 """
 
 
+# таймаут установки схемы при старте (сек)
+INIT_DB_TIMEOUT_SECONDS = 3600
+
+
 async def init_db(pool: asyncpg.Pool) -> None:
-    async with pool.acquire() as conn:
-        await conn.execute(CREATE_TABLES_SQL)
+    # command_timeout пула (10 сек) рассчитан на запросы хэндлеров; дедупликация
+    # и построение индексов на большой equity_snapshots могут идти дольше,
+    # а оборванный скрипт откатывается целиком. timeout=None здесь не помогает —
+    # asyncpg подставляет command_timeout, поэтому задаём свой явно
+    await pool.execute(CREATE_TABLES_SQL, timeout=INIT_DB_TIMEOUT_SECONDS)
+
 
+async def ensure_user_get_lang(pool: asyncpg.Pool, tg_id: int) -> str:
+    """
+    Регистрирует пользователя и возвращает его язык за один запрос.
+    DO UPDATE SET id=EXCLUDED.id — пустое обновление, чтобы RETURNING
+    вернул строку и для уже существующего пользователя.
+    Для уже виденного процессом пользователя upsert пропускаем
+    и берём язык из кеша (или одним SELECT, если запись устарела).
+    """
+    if tg_id in _known_users:
+        return await get_user_lang(pool, tg_id)
 
-async def ensure_user(pool: asyncpg.Pool, tg_id: int) -> None:
-    async with pool.acquire() as conn:
-        await conn.execute(
-            "INSERT INTO tg_users (id) VALUES ($1) ON CONFLICT (id) DO NOTHING",
-            tg_id,
-        )
+    lang = await pool.fetchval(
+        """
+        INSERT INTO tg_users (id) VALUES ($1)
+        ON CONFLICT (id) DO UPDATE SET id=EXCLUDED.id
+        RETURNING lang
+        """,
+        tg_id,
+    )
+    lang = lang or LANG_DEFAULT
+    _mark_known(tg_id)
+    _cache_lang(tg_id, lang)
+    return lang
 
 
 async def get_user_lang(pool: asyncpg.Pool, user_id: int) -> str:
-    async with pool.acquire() as conn:
-        row = await conn.fetchrow("SELECT lang FROM tg_users WHERE id=$1", user_id)
+    cached = _lang_cache.get(user_id)
+    if cached and time.monotonic() - cached[1] < LANG_CACHE_TTL_SECONDS:
+        return cached[0]
+
+    row = await pool.fetchrow("SELECT lang FROM tg_users WHERE id=$1", user_id)
     lang = row["lang"] if row and row["lang"] else None
-    return lang or LANG_DEFAULT
+    lang = lang or LANG_DEFAULT
+    _cache_lang(user_id, lang)
+    return lang
 
 
 async def set_user_lang(pool: asyncpg.Pool, user_id: int, lang: str) -> None:
-    async with pool.acquire() as conn:
-        await conn.execute(
-            "UPDATE tg_users SET lang=$1 WHERE id=$2",
-            lang,
-            user_id,
-        )
+    await pool.execute(
+        "UPDATE tg_users SET lang=$1 WHERE id=$2",
+        lang,
+        user_id,
+    )
+    _cache_lang(user_id, lang)
 
 
 async def save_wallet(
@@ -90,44 +249,21 @@ async def save_wallet(
     Добавляет кошелёк или кита в БД.
     Возвращает: "exists", "wallet_added", "whale_added".
     """
-    async with pool.acquire() as conn:
-        row = await conn.fetchrow(
-            """
-            SELECT id FROM wallets
-            WHERE tg_user_id=$1 AND address=$2 AND is_whale=$3
-            """,
-            tg_user_id,
-            address,
-            is_whale,
-        )
-        if row:
-            return "exists"
-
-        if is_whale:
-            w_id = await conn.fetchval(
-                """
-                INSERT INTO wallets (tg_user_id, address, label, is_whale, whale_alerts_enabled)
-                VALUES ($1, $2, $3, TRUE, TRUE)
-                RETURNING id
-                """,
-                tg_user_id,
-                address,
-                label,
-            )
-            await conn.execute(
-                "INSERT INTO activity_markers (wallet_id, last_seen_timestamp) VALUES ($1, $2)",
-                w_id,
-                0,
-            )
-            return "whale_added"
-        else:
-            await conn.execute(
-                """
-                INSERT INTO wallets (tg_user_id, address, label, is_whale, alerts_enabled)
-                VALUES ($1, $2, $3, FALSE, TRUE)
-                """,
-                tg_user_id,
-                address,
-                label,
-            )
-            return "wallet_added"
+    result = await pool.fetchval(SAVE_WALLET_SQL, tg_user_id, address, label, is_whale)
+    if result != "exists":
+        _wallets_cache.pop(tg_user_id, None)
+    return result
+
+
+async def get_user_wallets(pool: asyncpg.Pool, tg_user_id: int) -> List[asyncpg.Record]:
+    """Кошельки пользователя в порядке экрана состояния (сначала свои, потом киты)."""
+    cached = _wallets_cache.get(tg_user_id)
+    if cached and time.monotonic() - cached[1] < WALLETS_CACHE_TTL_SECONDS:
+        return cached[0]
+
+    rows = await pool.fetch(SELECT_USER_WALLET_LIST, tg_user_id)
+    _wallets_cache.pop(tg_user_id, None)
+    if len(_wallets_cache) >= WALLETS_CACHE_MAX_SIZE:
+        _wallets_cache.pop(next(iter(_wallets_cache)))
+    _wallets_cache[tg_user_id] = (rows, time.monotonic())
+    return rows
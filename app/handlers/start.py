@@ -3,18 +3,18 @@ from aiogram.filters import Command
 from aiogram.types import Message, CallbackQuery
 
 from app import core
-from app.db import ensure_user, get_user_lang, set_user_lang
-from app.keyboards import language_inline_keyboard, main_menu_keyboard, get_main_text
+from app.db import ensure_user_get_lang, get_user_lang, set_user_lang
+from app.keyboards import BTN_BACK, language_inline_keyboard, main_menu_keyboard, get_main_text
 
 dp = core.dp
 
+LANG_SAVED = {"en": "✅ Language set", "ru": "✅ Язык сохранён"}
+
 
 @dp.message(Command("start"))
 async def cmd_start(message: Message):
     assert core.db_pool is not None
-    await ensure_user(core.db_pool, message.from_user.id)
-
-    lang = await get_user_lang(core.db_pool, message.from_user.id)
+    lang = await ensure_user_get_lang(core.db_pool, message.from_user.id)
 
     if not lang:
         await message.answer(
@@ -40,9 +40,7 @@ async def cb_set_lang(callback: CallbackQuery):
     kb = main_menu_keyboard(lang)
 
     try:
-        await callback.message.edit_text(
-            "✅ Language set" if lang == "en" else "✅ Язык сохранён"
-        )
+        await callback.message.edit_text(LANG_SAVED[lang])
     except Exception:
         pass
 
@@ -54,7 +52,7 @@ async def cb_set_lang(callback: CallbackQuery):
     await callback.answer("OK")
 
 
-@dp.message(F.text.in_(["⬅ Back", "⬅ Назад"]))
+@dp.message(F.text.in_(BTN_BACK))
 async def btn_back(message: Message):
     assert core.db_pool is not None
     lang = await get_user_lang(core.db_pool, message.from_user.id)
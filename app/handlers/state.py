@@ -1,58 +1,113 @@
-from typing import List, Dict, Any
+import asyncio
+import math
+from typing import Dict, Any, Optional
 
 from aiogram import F
 from aiogram.filters import Command
 from aiogram.types import Message, CallbackQuery
 
 from app import core
-from app.db import ensure_user, get_user_lang
-from app.keyboards import main_menu_keyboard, get_main_text
+from app.db import ensure_user_get_lang, get_user_lang, get_user_wallets
+from app.keyboards import BTN_STATE, main_menu_keyboard, get_main_text
 from app.polymarket import pm_get_positions, pm_get_value
 
 dp = core.dp
 
+# тексты экрана состояния: язык выбираем один раз, дальше только format
+TEMPLATES: Dict[str, Dict[str, str]] = {
+    "ru": {
+        "empty": (
+            "У тебя пока нет кошельков.\n"
+            "Нажми «➕ Мой кошелёк» или «➕ Кит» и отправь ссылку на профиль Polymarket."
+        ),
+        "header": (
+            "{icon} Кошелёк {page}/{n}\n\n"
+            "Имя аккаунта: <b>{account_name}</b>\n"
+            "Адрес: <code>{address}</code>\n"
+            "Количество активных позиций: {active_count}\n"
+            "Portfolio: <b>{portfolio}</b>\n"
+            "Profit/Loss: <b>{pnl}</b>\n"
+        ),
+        "open": "Открытые позиции:",
+        "no_open": "Открытых позиций нет.",
+        "untitled": "Без названия",
+        "back": "⬅ Назад",
+    },
+    "en": {
+        "empty": (
+            "You don't have any wallets yet.\n"
+            "Press “➕ My wallet” or “➕ Whale” and send a Polymarket profile link."
+        ),
+        "header": (
+            "{icon} Wallet {page}/{n}\n\n"
+            "Account name: <b>{account_name}</b>\n"
+            "Address: <code>{address}</code>\n"
+            "Active positions: {active_count}\n"
+            "Portfolio: <b>{portfolio}</b>\n"
+            "Profit/Loss: <b>{pnl}</b>\n"
+        ),
+        "open": "Open positions:",
+        "no_open": "No open positions.",
+        "untitled": "Untitled market",
+        "back": "⬅ Back",
+    },
+}
+
+POSITION_LINE = (
+    "{title} - {outcome} value {value:.2f} USDC "
+    "({cash:+.2f}$) - {pct:+.2f}%"
+)
+
+
+def _to_float(v: Any, default: float = 0.0) -> float:
+    """float из ответа Polymarket; числа идут быстрым путём без try/except."""
+    if isinstance(v, (int, float)):
+        return float(v)
+    if v is None:
+        return default
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return default
+
+
+def _position_line(p: Dict[str, Any], untitled: str) -> str:
+    return POSITION_LINE.format(
+        title=p.get("title") or untitled,
+        outcome=p.get("outcome") or "?",
+        value=_to_float(p.get("value") or p.get("positionValue") or p.get("positionValueUsd")),
+        cash=_to_float(p.get("cashPnl")),
+        pct=_to_float(p.get("percentPnl")),
+    )
+
 
 async def show_wallet_state(
     msg: Message,
     tg_user_id: int,
     page: int = 0,
     edit: bool = False,
+    lang: Optional[str] = None,
 ):
     """Показывает состояние одного кошелька с пагинацией по кошелькам."""
     assert core.db_pool is not None
 
-    lang = await get_user_lang(core.db_pool, tg_user_id)
-
-    async with core.db_pool.acquire() as conn:
-        wallets = await conn.fetch(
-            """
-            SELECT id, address, label, is_whale
-            FROM wallets
-            WHERE tg_user_id=$1
-            ORDER BY is_whale, created_at
-            """,
-            tg_user_id,
-        )
+    if lang is None:
+        lang = await get_user_lang(core.db_pool, tg_user_id)
+    tpl = TEMPLATES["ru" if lang == "ru" else "en"]
 
-    if not wallets:
-        if lang == "ru":
-            text = (
-                "У тебя пока нет кошельков.\n"
-                "Нажми «➕ Мой кошелёк» или «➕ Кит» и отправь ссылку на профиль Polymarket."
-            )
-        else:
-            text = (
-                "You don't have any wallets yet.\n"
-                "Press “➕ My wallet” or “➕ Whale” and send a Polymarket profile link."
-            )
+    # список кошельков кешируется на пользователя: листание страниц идёт без БД
+    wallets = await get_user_wallets(core.db_pool, tg_user_id)
+
+    n = len(wallets)
+    if not n:
+        text = tpl["empty"]
         if edit:
             await msg.edit_text(text)
         else:
             await msg.answer(text, reply_markup=main_menu_keyboard(lang))
         return
 
-    n = len(wallets)
-    page = page % n
+    page = max(page, 0) % n
     w = wallets[page]
     address = w["address"]
     label = w["label"]
@@ -61,91 +116,46 @@ async def show_wallet_state(
 
     account_name = label or f"{address[:6]}...{address[-4:]}"
 
-    try:
-        positions = await pm_get_positions(address)
-    except Exception:
+    positions, portfolio_value = await asyncio.gather(
+        pm_get_positions(address),
+        pm_get_value(address),
+        return_exceptions=True,
+    )
+    if isinstance(positions, Exception):
         positions = []
-
-    try:
-        portfolio_value = await pm_get_value(address)
-    except Exception:
+    if isinstance(portfolio_value, Exception):
         portfolio_value = None
 
     active_positions = positions
     active_count = len(active_positions)
 
-    total_pnl = 0.0
-    for p in active_positions:
-        try:
-            total_pnl += float(p.get("cashPnl") or 0.0)
-        except Exception:
-            pass
+    total_pnl = math.fsum(_to_float(p.get("cashPnl")) for p in active_positions)
 
     portfolio_str = f"{portfolio_value:.2f} USDC" if portfolio_value is not None else "n/a"
-    sign_pnl = "+" if total_pnl >= 0 else ""
-    pnl_str = f"{sign_pnl}{total_pnl:.2f} USDC"
-
-    lines: List[str] = []
-
-    if lang == "ru":
-        lines.append(f"{icon} Кошелёк {page + 1}/{n}\n")
-        lines.append(f"Имя аккаунта: <b>{account_name}</b>")
-        lines.append(f"Адрес: <code>{address}</code>")
-        lines.append(f"Количество активных позиций: {active_count}")
-        lines.append(f"Portfolio: <b>{portfolio_str}</b>")
-        lines.append(f"Profit/Loss: <b>{pnl_str}</b>\n")
-        if active_positions:
-            lines.append("Открытые позиции:")
-        else:
-            lines.append("Открытых позиций нет.")
-    else:
-        lines.append(f"{icon} Wallet {page + 1}/{n}\n")
-        lines.append(f"Account name: <b>{account_name}</b>")
-        lines.append(f"Address: <code>{address}</code>")
-        lines.append(f"Active positions: {active_count}")
-        lines.append(f"Portfolio: <b>{portfolio_str}</b>")
-        lines.append(f"Profit/Loss: <b>{pnl_str}</b>\n")
-        if active_positions:
-            lines.append("Open positions:")
-        else:
-            lines.append("No open positions.")
-
-    for p in active_positions:
-        title = p.get("title") or ("Без названия" if lang == "ru" else "Untitled market")
-        outcome = p.get("outcome") or "?"
-        value_raw = p.get("value") or p.get("positionValue") or p.get("positionValueUsd")
-        try:
-            value_f = float(value_raw) if value_raw is not None else 0.0
-        except Exception:
-            value_f = 0.0
-
-        cash_raw = p.get("cashPnl")
-        pct_raw = p.get("percentPnl")
-        try:
-            cash_f = float(cash_raw) if cash_raw is not None else 0.0
-        except Exception:
-            cash_f = 0.0
-        try:
-            pct_f = float(pct_raw) if pct_raw is not None else 0.0
-        except Exception:
-            pct_f = 0.0
-
-        sign_cash = "+" if cash_f >= 0 else ""
-        sign_pct = "+" if pct_f >= 0 else ""
-
-        line = (
-            f"{title} - {outcome} value {value_f:.2f} USDC "
-            f"({sign_cash}{cash_f:.2f}$) - {sign_pct}{pct_f:.2f}%"
+    pnl_str = f"{total_pnl:+.2f} USDC"
+
+    header = tpl["header"].format(
+        icon=icon,
+        page=page + 1,
+        n=n,
+        account_name=account_name,
+        address=address,
+        active_count=active_count,
+        portfolio=portfolio_str,
+        pnl=pnl_str,
+    )
+    if active_positions:
+        untitled = tpl["untitled"]
+        text = "\n".join(
+            [header, tpl["open"], *(_position_line(p, untitled) for p in active_positions)]
         )
-        lines.append(line)
-
-    text = "\n".join(lines)
+    else:
+        text = "\n".join([header, tpl["no_open"]])
 
     from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
     next_index = (page + 1) % n
     prev_index = (page - 1) % n
-    back_text = "⬅ Назад" if lang == "ru" else "⬅ Back"
 
     inline_kb = InlineKeyboardMarkup(
         inline_keyboard=[
@@ -154,7 +164,7 @@ async def show_wallet_state(
                 InlineKeyboardButton(text=f"{page + 1}/{n}", callback_data="st_nop"),
                 InlineKeyboardButton(text="▶", callback_data=f"st:{next_index}"),
             ],
-            [InlineKeyboardButton(text=back_text, callback_data="st_back")],
+            [InlineKeyboardButton(text=tpl["back"], callback_data="st_back")],
         ]
     )
 
@@ -167,8 +177,8 @@ async def show_wallet_state(
 @dp.message(Command("state"))
 async def cmd_state(message: Message):
     assert core.db_pool is not None
-    await ensure_user(core.db_pool, message.from_user.id)
-    await show_wallet_state(message, message.from_user.id, page=0, edit=False)
+    lang = await ensure_user_get_lang(core.db_pool, message.from_user.id)
+    await show_wallet_state(message, message.from_user.id, page=0, edit=False, lang=lang)
 
 
 @dp.callback_query(F.data == "st_nop")
@@ -205,6 +215,6 @@ async def cb_state_page(callback: CallbackQuery):
     await callback.answer()
 
 
-@dp.message(F.text.in_(["📈 Состояние", "📈 Status"]))
+@dp.message(F.text.in_(BTN_STATE))
 async def btn_state(message: Message):
     await cmd_state(message)
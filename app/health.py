@@ -3,15 +3,22 @@ from aiohttp import web
 
 
 async def health(request: web.Request) -> web.Response:
-    return web.Response(text="OK")
+    return web.Response(body=b"OK", content_type="text/plain")
 
 
-async def start_health_server():
+async def start_health_server() -> web.AppRunner:
+    """
+    Поднимает health-эндпоинт на общем event loop.
+    Возвращает runner — его нужно закрыть через runner.cleanup() при остановке.
+    """
     app = web.Application()
     app.router.add_get("/", health)
-    runner = web.AppRunner(app)
+    # на health-чеке нечего дожидаться — при остановке не ждём дефолтные 60 сек;
+    # access-лог выключен: пробы Koyeb иначе пишут строку в лог на каждый запрос
+    runner = web.AppRunner(app, shutdown_timeout=1.0, access_log=None)
     await runner.setup()
 
     port = int(os.getenv("PORT", "8000"))
     site = web.TCPSite(runner, "0.0.0.0", port)
     await site.start()
+    return runner
@@ -1,3 +1,5 @@
+from functools import lru_cache
+
 from aiogram.types import (
     InlineKeyboardMarkup,
     InlineKeyboardButton,
@@ -6,6 +8,15 @@ from aiogram.types import (
 )
 
 
+# тексты кнопок главного меню на всех языках — для фильтров F.text.in_(...)
+BTN_MY_WALLET = frozenset(("➕ Мой кошелёк", "➕ My wallet"))
+BTN_WHALE = frozenset(("➕ Кит", "➕ Whale"))
+BTN_WALLETS = frozenset(("📊 Мои кошельки", "📊 My wallets"))
+BTN_STATE = frozenset(("📈 Состояние", "📈 Status"))
+BTN_BACK = frozenset(("⬅ Назад", "⬅ Back"))
+MENU_BUTTONS = BTN_MY_WALLET | BTN_WHALE | BTN_WALLETS | BTN_STATE | BTN_BACK
+
+
 def language_inline_keyboard() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         inline_keyboard=[
@@ -15,6 +26,8 @@ def language_inline_keyboard() -> InlineKeyboardMarkup:
     )
 
 
+# клавиатура и текст зависят только от языка — собираем один раз на язык
+@lru_cache(maxsize=8)
 def main_menu_keyboard(lang: str) -> ReplyKeyboardMarkup:
     if lang == "ru":
         keyboard = [
@@ -43,6 +56,7 @@ def main_menu_keyboard(lang: str) -> ReplyKeyboardMarkup:
     return ReplyKeyboardMarkup(resize_keyboard=True, keyboard=keyboard)
 
 
+@lru_cache(maxsize=8)
 def get_main_text(lang: str) -> str:
     if lang == "ru":
         return (
@@ -1,47 +1,179 @@
+import asyncio
+import functools
 import re
-from typing import Optional, List, Dict, Any
+import time
+from typing import Optional, List, Dict, Any, Tuple
+
+import httpx
+import orjson
 
 from . import core
 
 DATA_API_BASE = "https://data-api.polymarket.com"
+GAMMA_API_BASE = "https://gamma-api.polymarket.com"
+
+WALLET_REGEX = re.compile(r"0x[a-fA-F0-9]{40}", re.IGNORECASE | re.ASCII)
+# ссылка на профиль: polymarket.com/@username (схема и www необязательны)
+PROFILE_REGEX = re.compile(
+    r"(?:https?://)?(?:www\.)?polymarket\.com/@([A-Za-z0-9_.\-]+)", re.ASCII
+)
+
+
+# числовые поля ответов data-api: приводим один раз при получении,
+# дальше потребители работают с готовыми float/int (или None)
+_FLOAT_FIELDS = ("price", "usdcSize", "percentPnl", "curPrice", "cashPnl", "value")
+_INT_FIELDS = ("timestamp",)
+
+
+def _coerce_record(d: Dict[str, Any]) -> Dict[str, Any]:
+    for key in _FLOAT_FIELDS:
+        v = d.get(key)
+        if v is not None and not isinstance(v, float):
+            try:
+                d[key] = float(v)
+            except (TypeError, ValueError):
+                d[key] = None
+    for key in _INT_FIELDS:
+        v = d.get(key)
+        if v is not None and not isinstance(v, int):
+            try:
+                d[key] = int(v)
+            except (TypeError, ValueError):
+                d[key] = None
+    return d
+
+
+def _loads(resp: httpx.Response) -> Any:
+    # orjson парсит сразу из байт, без промежуточного декодирования в str
+    return orjson.loads(resp.content)
+
+
+# короткий кэш ответов data-api с объединением одновременных запросов:
+# если один адрес нужен сразу нескольким мониторам/юзерам, HTTP-запрос идёт один,
+# остальные ждут тот же future. TTL не больше половины интервала опроса
+# (интервалы задаются из ENV), чтобы каждый тик всё равно видел свежие данные.
+PM_CACHE_TTL_SECONDS = 20
+PM_CACHE_MAX_SIZE = 512
+
+
+def _pm_cache_ttl() -> float:
+    cfg = core.config
+    if cfg is None:
+        return PM_CACHE_TTL_SECONDS
+    shortest = min(cfg.poll_interval_seconds, cfg.whale_poll_interval_seconds)
+    return min(PM_CACHE_TTL_SECONDS, shortest / 2)
+
+
+def _single_flight(fn):
+    # аргументы вызова -> (monotonic-время запуска, задача);
+    # порядок dict = порядок запуска, первым выкидываем самый старый
+    cache: Dict[Tuple[Any, ...], Tuple[float, "asyncio.Future[Any]"]] = {}
+
+    @functools.wraps(fn)
+    async def wrapper(*args: Any, **kwargs: Any) -> Any:
+        key = args + tuple(sorted(kwargs.items()))
+        now = time.monotonic()
+        entry = cache.get(key)
+        if entry is None or now - entry[0] >= _pm_cache_ttl():
+            cache.pop(key, None)
+            while len(cache) >= PM_CACHE_MAX_SIZE:
+                cache.pop(next(iter(cache)))
+            entry = (now, asyncio.ensure_future(fn(*args, **kwargs)))
+            cache[key] = entry
+        task = entry[1]
+        try:
+            # shield: отмена одного ожидающего не должна ронять запрос остальным
+            return await asyncio.shield(task)
+        except Exception:
+            # ошибки не кэшируем — следующий вызов сходит в API заново
+            if cache.get(key) is entry:
+                del cache[key]
+            raise
 
-WALLET_REGEX = re.compile(r"0x[a-fA-F0-9]{40}", re.IGNORECASE)
+    return wrapper
 
 
 def extract_wallet_address(text: str) -> Optional[str]:
-    if not text:
+    # дешёвая проверка подстроки отсекает большинство текстов без адреса
+    if not text or ("0x" not in text and "0X" not in text):
         return None
     m = WALLET_REGEX.search(text)
     return m.group(0) if m else None
 
 
-async def pm_get_positions(address: str) -> List[Dict[str, Any]]:
+# профиль -> адрес почти не меняется: кэшируем удачные резолвы,
+# чтобы повторная отправка той же ссылки не ходила в API заново.
+# username в нижнем регистре -> (адрес, monotonic-время записи)
+PROFILE_CACHE_TTL_SECONDS = 3600
+PROFILE_CACHE_MAX_SIZE = 1024
+_profile_cache: Dict[str, Tuple[str, float]] = {}
+
+MAX_HTML_SCAN_CHARS = 200_000
+
+_NEXT_DATA_OPEN = '<script id="__NEXT_DATA__"'
+_SCRIPT_CLOSE = "</script>"
+
+
+def _next_data_blob(html: str) -> Optional[str]:
+    """
+    Вырезает JSON из <script id="__NEXT_DATA__"> — там лежат данные профиля.
+    Ищем через str.find, без HTML-парсера: тег один и формат у Next.js стабильный.
+    """
+    start = html.find(_NEXT_DATA_OPEN)
+    if start < 0:
+        return None
+    start = html.find(">", start)
+    if start < 0:
+        return None
+    end = html.find(_SCRIPT_CLOSE, start)
+    if end < 0:
+        return None
+    return html[start + 1:end]
+
+
+# условные GET к data-api: помним ETag и разобранный ответ по (путь, параметры),
+# на 304 отдаём сохранённое вместо повторной загрузки и парсинга
+ETAG_STORE_MAX_SIZE = 2048
+_etag_store: Dict[Tuple[str, Tuple[Tuple[str, Any], ...]], Tuple[str, Any]] = {}
+
+
+async def _get_data_api(path: str, params: Dict[str, Any]) -> Any:
     assert core.http_client is not None
-    resp = await core.http_client.get(
-        f"{DATA_API_BASE}/positions",
-        params={"user": address, "sizeThreshold": 0},
-        timeout=20.0,
-    )
+    key = (path, tuple(sorted(params.items())))
+    cached = _etag_store.get(key)
+    headers = {"If-None-Match": cached[0]} if cached else None
+
+    resp = await core.http_client.get(path, params=params, headers=headers)
+    if resp.status_code == 304 and cached:
+        return cached[1]
     resp.raise_for_status()
-    return resp.json()
+    data = _loads(resp)
 
+    etag = resp.headers.get("etag")
+    if etag:
+        _etag_store.pop(key, None)
+        if len(_etag_store) >= ETAG_STORE_MAX_SIZE:
+            _etag_store.pop(next(iter(_etag_store)))
+        _etag_store[key] = (etag, data)
+    return data
 
+
+@_single_flight
+async def pm_get_positions(address: str) -> List[Dict[str, Any]]:
+    data = await _get_data_api("/positions", {"user": address, "sizeThreshold": 0})
+    return [_coerce_record(p) for p in data]
+
+
+@_single_flight
 async def pm_get_value(address: str) -> Optional[float]:
-    assert core.http_client is not None
-    resp = await core.http_client.get(
-        f"{DATA_API_BASE}/value",
-        params={"user": address},
-        timeout=20.0,
-    )
-    resp.raise_for_status()
-    data = resp.json()
+    data = await _get_data_api("/value", {"user": address})
     if isinstance(data, list) and data:
         return float(data[0].get("value", 0.0))
     return None
 
 
+@_single_flight
 async def pm_get_activity_trades(address: str, since_ts: Optional[int] = None) -> List[Dict[str, Any]]:
-    assert core.http_client is not None
     params: Dict[str, Any] = {
         "user": address,
         "limit": 100,
@@ -49,16 +181,12 @@ async def pm_get_activity_trades(address: str, since_ts: Optional[int] = None) -
         "sortBy": "TIMESTAMP",
         "sortDirection": "DESC",
     }
-    resp = await core.http_client.get(
-        f"{DATA_API_BASE}/activity",
-        params=params,
-        timeout=20.0,
-    )
-    resp.raise_for_status()
-    trades = resp.json()
-    if since_ts is None:
-        return trades
-    return [t for t in trades if int(t.get("timestamp", 0)) > since_ts]
+    if since_ts:
+        # фильтруем на стороне API: start включительный, поэтому +1,
+        # чтобы не тянуть заново уже виденную сделку
+        params["start"] = since_ts + 1
+    data = await _get_data_api("/activity", params)
+    return [_coerce_record(t) for t in data]
 
 
 async def resolve_wallet_or_profile(text: str) -> Optional[str]:
@@ -66,7 +194,8 @@ async def resolve_wallet_or_profile(text: str) -> Optional[str]:
     Понимает:
     - 0x-адрес
     - ссылки с 0x (wallet/profile)
-    - ссылки вида polymarket.com/@username (парсим страницу)
+    - ссылки вида polymarket.com/@username (ищем профиль через Gamma API,
+      при неудаче парсим страницу)
     """
     if not text:
         return None
@@ -75,23 +204,78 @@ async def resolve_wallet_or_profile(text: str) -> Optional[str]:
     if addr:
         return addr
 
-    m = re.search(
-        r"(https?://)?(www\.)?polymarket\.com/@([A-Za-z0-9_\-\.]+)",
-        text,
-    )
+    m = PROFILE_REGEX.search(text)
     if not m:
         return None
 
-    url = m.group(0)
-    if not url.startswith("http"):
-        url = "https://" + url
+    return await _resolve_username(m.group(1))
+
+
+async def _resolve_username(username: str) -> Optional[str]:
+    key = username.lower()
+    cached = _profile_cache.get(key)
+    if cached and time.monotonic() - cached[1] < PROFILE_CACHE_TTL_SECONDS:
+        return cached[0]
+
+    # короткий JSON из Gamma API вместо скачивания всей страницы профиля
+    address = await _lookup_username(username)
+    if not address:
+        address = await _scrape_profile_page(username)
+
+    if address:
+        _profile_cache.pop(key, None)
+        if len(_profile_cache) >= PROFILE_CACHE_MAX_SIZE:
+            # выкидываем самую старую запись (dict хранит порядок вставки)
+            _profile_cache.pop(next(iter(_profile_cache)))
+        _profile_cache[key] = (address, time.monotonic())
+    return address
+
+
+async def _lookup_username(username: str) -> Optional[str]:
+    """Ищет proxyWallet профиля по точному совпадению имени в поиске Gamma API."""
+    assert core.http_client is not None
+    try:
+        resp = await core.http_client.get(
+            f"{GAMMA_API_BASE}/public-search",
+            params={"q": username, "search_profiles": "true", "limit_per_type": 10},
+        )
+        resp.raise_for_status()
+        data = _loads(resp)
+    except Exception:
+        return None
+
+    profiles = data.get("profiles") if isinstance(data, dict) else None
+    wanted = username.lower()
+    for profile in profiles or []:
+        names = (profile.get("name"), profile.get("pseudonym"))
+        if any(n and n.lower() == wanted for n in names):
+            return extract_wallet_address(profile.get("proxyWallet") or "")
+    return None
+
 
+async def _scrape_profile_page(username: str) -> Optional[str]:
     assert core.http_client is not None
     try:
-        resp = await core.http_client.get(url, timeout=20.0)
+        resp = await core.http_client.get(f"https://polymarket.com/@{username}")
         resp.raise_for_status()
         html = resp.text
-        addr_from_html = extract_wallet_address(html)
-        return addr_from_html
     except Exception:
         return None
+
+    # страница большая: разбор уводим в поток, чтобы не держать event loop;
+    # страницы без "0x" отсекаем сразу, без прыжка в поток
+    if "0x" not in html and "0X" not in html:
+        return None
+    return await asyncio.to_thread(_address_from_html, html)
+
+
+def _address_from_html(html: str) -> Optional[str]:
+    # сначала смотрим только в __NEXT_DATA__ (несколько КБ), а не во весь HTML;
+    # если Next.js-блока нет — откатываемся на поиск по всей странице
+    blob = _next_data_blob(html)
+    if blob is not None:
+        address = extract_wallet_address(blob)
+        if address:
+            return address
+    # на случай огромной страницы ограничиваем область поиска
+    return extract_wallet_address(html[:MAX_HTML_SCAN_CHARS])
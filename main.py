@@ -1,4 +1,5 @@
 import asyncio
+import logging
 
 import asyncpg
 import httpx
@@ -8,13 +9,21 @@ from aiogram.client.default import DefaultBotProperties
 
 from app.config import Config
 from app import core
-from app.db import init_db
+from app.db import STATEMENT_CACHE_SIZE, init_db
 from app.health import start_health_server
-from app.background import monitor_positions, monitor_whales
+from app.polymarket import DATA_API_BASE
+from app.background import (
+    listen_wallet_changes,
+    monitor_positions,
+    monitor_whales,
+    shutdown_alerts,
+)
 from app.handlers import register_handlers
 
 
 async def main():
+    logging.basicConfig(level=logging.INFO)
+
     # читаем конфиг из ENV
     cfg = Config.from_env()
     core.config = cfg
@@ -24,8 +33,47 @@ async def main():
         token=cfg.bot_token,
         default=DefaultBotProperties(parse_mode=ParseMode.HTML),
     )
-    core.db_pool = await asyncpg.create_pool(dsn=cfg.database_url)
-    core.http_client = httpx.AsyncClient(timeout=20.0)
+    # asyncpg сам держит prepared statements в LRU-кеше каждого соединения
+    # (ключ — текст запроса), поэтому горячие запросы вынесены в константы.
+    # Размеры пула и время жизни простаивающих соединений — из ENV
+    # (DB_POOL_MIN_SIZE / DB_POOL_MAX_SIZE / DB_POOL_MAX_IDLE_SECONDS)
+    core.db_pool = await asyncpg.create_pool(
+        dsn=cfg.database_url,
+        min_size=cfg.db_pool_min_size,
+        max_size=cfg.db_pool_max_size,
+        max_inactive_connection_lifetime=cfg.db_pool_max_idle_seconds,
+        command_timeout=10,
+        statement_cache_size=STATEMENT_CACHE_SIZE,
+    )
+    # отдельный пул фоновых мониторов: тик с кучей кошельков не должен
+    # выбирать соединения, нужные хэндлерам. Оба монитора держат до
+    # max_concurrency соединений каждый, плюс одно занято под LISTEN
+    core.db_pool_bg = await asyncpg.create_pool(
+        dsn=cfg.database_url,
+        min_size=1,
+        max_size=2 * cfg.max_concurrency + 2,
+        max_inactive_connection_lifetime=cfg.db_pool_max_idle_seconds,
+        command_timeout=10,
+        statement_cache_size=STATEMENT_CACHE_SIZE,
+    )
+    # один клиент на всё приложение: keep-alive и HTTP/2 к data-api.polymarket.com.
+    # base_url — data-api: pm_* ходят по относительным путям, остальные хосты
+    # (Gamma, сайт) запрашиваются абсолютными URL
+    core.http_client = httpx.AsyncClient(
+        base_url=DATA_API_BASE,
+        # при явном transport http2 и limits задаются на нём, а не на клиенте.
+        # retries — только повтор установки соединения, не запросов
+        transport=httpx.AsyncHTTPTransport(
+            http2=True,
+            retries=2,
+            # опрос идёт раз в минуту — держим соединения дольше интервала,
+            # чтобы не переоткрывать TLS на каждом тике
+            limits=httpx.Limits(
+                max_connections=64, max_keepalive_connections=32, keepalive_expiry=90.0
+            ),
+        ),
+        timeout=httpx.Timeout(10.0, connect=5.0),
+    )
 
     # инициализация БД
     await init_db(core.db_pool)
@@ -34,11 +82,15 @@ async def main():
     register_handlers()
 
     # health-сервер для Koyeb
-    await start_health_server()
+    health_runner = await start_health_server()
 
-    # фоновые задачи
-    asyncio.create_task(monitor_positions())
-    asyncio.create_task(monitor_whales())
+    # фоновые задачи: держим ссылки, чтобы при остановке отменить их
+    # до закрытия пулов, а не рвать посреди записи в БД
+    bg_tasks = [
+        asyncio.create_task(monitor_positions()),
+        asyncio.create_task(monitor_whales()),
+        asyncio.create_task(listen_wallet_changes()),
+    ]
 
     # запускаем long polling
     try:
@@ -46,7 +98,14 @@ async def main():
             core.bot, allowed_updates=core.dp.resolve_used_update_types()
         )
     finally:
+        for task in bg_tasks:
+            task.cancel()
+        await asyncio.gather(*bg_tasks, return_exceptions=True)
+        # очереди алертов досылаем, пока сессия бота ещё открыта
+        await shutdown_alerts()
+        await health_runner.cleanup()
         await core.http_client.aclose()
+        await core.db_pool_bg.close()
         await core.db_pool.close()
         await core.bot.session.close()
 